@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # encoding: utf-8
 """
 check_solr_index_version_age.py
@@ -22,6 +22,10 @@ Options:
                         SOLR Server address to connect to
   -p SOLR_SERVER_PORT, --port=SOLR_SERVER_PORT
                         SOLR Server port to connector
+  -m MASTER_SERVER, --masterhost=MASTER_SERVER
+                        SOLR master server address (host or host:port) for the
+                        replication check (-R only) to compare index versions
+                        with directly
   -u SOLR_SERVER_PATH, --contextpath=SOLR_SERVER_PATH
                         SOLR Server's context path i.e. solr
   -P, --pingcheck       Monitroing Check: simple url ping that checks the solr
@@ -39,6 +43,9 @@ Options:
                         The comma separated list of solr cores to be checked
   -t TIMEOUT, --timeout=TIMEOUT
                         The timeout for the request to solr
+  -D DEADLINE, --deadline=DEADLINE
+                        The overall time allowed for checking all the cores,
+                        defaults to twice the timeout
   -d, --disabled        The monitoring check is disabled, just return ok status
 
 The three checks are:
@@ -48,7 +55,8 @@ The three checks are:
       then you could be affected by timescew (NTP). The -c and -w are the number of seconds old the index can be.
 
 -R  : Calls the slave's replication details endpoint. And obtains the "indexVersion" of the slave and master, and compares these two values against 
-      each other.  The -c and -w are the number of seconds difference there can be between the master and slave index
+      each other.  The -c and -w are the number of seconds difference there can be between the master and slave index.
+      If the master is given with -m, the (much smaller) indexversion endpoint is called on the slave and on the master instead.
 
 -P  : Just calls the ping endpoint on the solr admin, to check the core is available
 
@@ -81,7 +89,7 @@ check_solr_index_version_age.py' -i core1 -R -H localhost -p 8080 -u solr -w 10
         {
             "age(s)": "-1", 
             "core": "core1", 
-            "msg": "timeout calling http://localhost:8080/solr/core1/replication?wt=json&command=details"
+            "msg": "timeout calling http://localhost:8080/solr/core1/replication?command=details&wt=json"
         }
     ], 
     "num_cores_checked": "1", 
@@ -94,86 +102,164 @@ check_solr_index_version_age.py' -i core1 -R -H localhost -p 8080 -u solr -w 10
 
 """
 
-import contextlib
-import datetime
-import urllib
+import collections
+import functools
+import gzip
+import http.client
+import json
+import multiprocessing
 import socket
-import urllib2, json
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+import zlib
+from multiprocessing.pool import ThreadPool
 from optparse import OptionParser
 
-def repstatus(core,timeout,corestatuschecks):
+try:
+    # parses the solr responses faster, if installed
+    from orjson import loads as jsonLoads
+except ImportError:
+    from json import loads as jsonLoads
+
+# request paths, relative to a core, for each of the checks
+REPLICATION_DETAILS_PATH = '/replication?command=details&wt=json'
+INDEX_VERSION_PATH = '/replication?command=indexversion&wt=json'
+PING_PATH = '/admin/ping?wt=json'
+
+# upper bound on the number of cores checked concurrently
+MAX_WORKERS = 16
+
+# number of http redirects followed for a single url, before giving up on it
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+# keep-alive http connections, one per solr host for each worker thread
+httpConnections = threading.local()
+
+
+class CoreStatus(object):
+    """ the result of checking a single core, recorded for later reporting
+
+    critical -- the number of critical statuses recorded for the core
+    warning -- the number of warning statuses recorded for the core
+    msg -- the message explaining why the core check failed, if any
+    age -- the age or lag, in seconds, found for the core's index.  -1 if not known
+
+    """
+
+    __slots__ = ('critical','warning','msg','age')
+
+    def __init__(self,critical=0,warning=0,msg='',age=-1):
+        self.critical = critical
+        self.warning = warning
+        self.msg = msg
+        self.age = age
+
+
+def repstatus(baseurl,core,timeout,corestatuschecks,masterbaseurl=None):
     """ calls <core>/replication?command=details&wt=json
     
     Obtaining the slave and master index version from the json output, and returns the difference in
-    seconds between the two for the given core
+    seconds between the two for the given core.  If the master's url is given the much smaller
+    indexversion responses of the slave and master are compared instead (see repIndexVersionStatus)
     
+    baseurl -- the url of the solr server, that the core names are appended to
     core -- the name of the core to check the index difference for
     timeout -- the time to wait for the http request to solr before returning with -1
     corestatuschecks -- the dict() object to record the time difference in, and any error message
+    masterbaseurl -- the url of the master solr server, or None to obtain the master's index version from the slave
 
     """
-    replicationUrl     = baseurl + core + '/replication?' + urllib.urlencode({'command':'details','wt':'json'})
+    if masterbaseurl is not None:
+        return repIndexVersionStatus(baseurl,core,timeout,corestatuschecks,masterbaseurl)
+
+    replicationUrl     = f'{baseurl}{core}{REPLICATION_DETAILS_PATH}'
     
-    diff = 0  
-    rdata = callUrl(replicationUrl,timeout,corestatuschecks,core)
-
-    if(len(rdata)==0):
-        diff=-1
-
-    slaveindexversion = None
-    masterindexversion = None
-    if(rdata.get('details') == None or rdata['details'].get('slave') == None):
-        if diff!=-1:
-            diff = -1
-            recordCheckMsg(core,'All Slave index version information not available. Host ok? '+replicationUrl,corestatuschecks)
-        
-    else:
-        slaveindexversion  = rdata['details'].get('indexVersion')
-        if rdata['details']['slave'].get('masterDetails') == None:
-            diff = -1
-            recordCheckMsg(core,'Slave unable to retrieve master index version information. Host able to contact master? '+replicationUrl,corestatuschecks)
-        else: 
-            masterindexversion = rdata['details']['slave']['masterDetails'].get('indexVersion')
-
-    if slaveindexversion == None:
-        if diff!=-1:
-            diff = -1
-            recordCheckMsg(core,'Slave index version information not available. Is this replicating? '+replicationUrl,corestatuschecks)
-    elif masterindexversion == None:
-        if diff!=-1:
-            diff = -1
-            recordCheckMsg(core,'Master index version information not available. Is the master avaialable? '+replicationUrl,corestatuschecks)
+    rdata = callUrl(coreUrl(baseurl,core,REPLICATION_DETAILS_PATH),timeout,corestatuschecks,core,replicationUrl)
+
+    details = rdata.get('details') or {}
+    slave = details.get('slave')
+    masterdetails = slave.get('masterDetails') if slave is not None else None
+    slaveindexversion = details.get('indexVersion')
+    masterindexversion = masterdetails.get('indexVersion') if masterdetails is not None else None
+
+    diff = -1
+    msg = None
+    if len(rdata)==0:
+        # callUrl has already recorded why the request failed
+        pass
+    elif slave is None:
+        msg = 'All Slave index version information not available. Host ok? '
+    elif masterdetails is None:
+        msg = 'Slave unable to retrieve master index version information. Host able to contact master? '
+    elif slaveindexversion is None:
+        msg = 'Slave index version information not available. Is this replicating? '
+    elif masterindexversion is None:
+        msg = 'Master index version information not available. Is the master avaialable? '
     else:
         diff = indexDiffInSeconds(masterindexversion,slaveindexversion)
 
+    if msg is not None:
+        recordCheckMsg(core,msg+replicationUrl,corestatuschecks)
+
     recordAge(core,diff,corestatuschecks)
 
     return diff
 
 
-def solrping(core,timeout,corestatuschecks):
+def repIndexVersionStatus(baseurl,core,timeout,corestatuschecks,masterbaseurl):
+    """ calls <core>/replication?command=indexversion&wt=json on the slave and then the master
+
+    Returns the difference in seconds between the slave's and master's index versions for the given core
+
+    baseurl -- the url of the slave solr server, that the core names are appended to
+    core -- the name of the core to check the index difference for
+    timeout -- the time to wait for each http request to solr before returning with -1
+    corestatuschecks -- the dict() object to record the time difference in, and any error message
+    masterbaseurl -- the url of the master solr server, that the core names are appended to
+
+    """
+    slaveUrl = f'{baseurl}{core}{INDEX_VERSION_PATH}'
+    masterUrl = f'{masterbaseurl}{core}{INDEX_VERSION_PATH}'
+
+    diff = -1
+    slavedata = callUrl(coreUrl(baseurl,core,INDEX_VERSION_PATH),timeout,corestatuschecks,core,slaveUrl)
+    if len(slavedata)==0:
+        # callUrl has already recorded why the request failed
+        pass
+    elif slavedata.get('indexversion') is None:
+        recordCheckMsg(core,'Slave index version information not available. Is this replicating? '+slaveUrl,corestatuschecks)
+    else:
+        masterdata = callUrl(coreUrl(masterbaseurl,core,INDEX_VERSION_PATH),timeout,corestatuschecks,core,masterUrl)
+        if len(masterdata)==0:
+            pass
+        elif masterdata.get('indexversion') is None:
+            recordCheckMsg(core,'Master index version information not available. Is the master avaialable? '+masterUrl,corestatuschecks)
+        else:
+            diff = indexDiffInSeconds(masterdata['indexversion'],slavedata['indexversion'])
+
+    recordAge(core,diff,corestatuschecks)
+
+    return diff
+
+
+def solrping(baseurl,core,timeout,corestatuschecks):
     """ calls <core>/admin/ping?wt=json
     
     parses the json output for the 'status' json response
     
+    baseurl -- the url of the solr server, that the core names are appended to
     core -- the name of the core to check for existence
     timeout -- the amount of time to wait on the request to solr for the ping, before stopping
      
     """
-    ping_cmd = baseurl + core + '/admin/ping?' + urllib.urlencode({'wt':'json'})
-
-    data = callUrl(ping_cmd,timeout,corestatuschecks,core)
-
-    # try:
-    #     with(contextlib.closing(urllib2.urlopen(ping_cmd,timeout = timeout))) as res:
-    #         data = json.loads(res.read())
-    # except urllib2.URLError, e:
-    #     return 'ERROR'
-    # except socket.timeout, e:
-    #     # For Python 2.7
-    #     return 'TIMEOUT'
-    # except socket.error, e:
-    #     return 'ERROR'
+    ping_cmd = f'{baseurl}{core}{PING_PATH}'
+
+    data = callUrl(coreUrl(baseurl,core,PING_PATH),timeout,corestatuschecks,core,ping_cmd)
+
     if(len(data))==0:
         return 'CRITICAL'
 
@@ -185,32 +271,32 @@ def solrping(core,timeout,corestatuschecks):
         return 'CRITICAL'
 
 
-def indexAgeInSeconds(core,timeout,corestatuschecks):
+def indexAgeInSeconds(baseurl,core,timeout,corestatuschecks,nowms):
     """ calls <core>/replication?command=indexversion&wt=json
     
     Obtains the indexversion for the current core/index.  The indexversion is the milliseconds
     since epoch of the last time a commit was done on the core.
     
-    This epoch is converted to seconds and compared to now() time on the current server where the script
-    is executing.  It returns the difference in seconds between the two values.
+    This epoch is compared to the given now time on the current server where the script is executing.
+    It returns the difference in seconds between the two values.
     
+    baseurl -- the url of the solr server, that the core names are appended to
     core -- the name of the core to obtain the index version for
     timeout -- the amount of time to wait on the request to solr
-    corestatuschecks -- the dict object to store the index seconds diff from now() and any associated error msg
+    corestatuschecks -- the dict object to store the index seconds diff from now and any associated error msg
+    nowms -- the milliseconds since epoch to measure the age of the index against
 
     """
 
-    replicationUrl = baseurl + core + '/replication?' + urllib.urlencode({'wt':'json', 'command' : 'indexversion'})
+    replicationUrl = f'{baseurl}{core}{INDEX_VERSION_PATH}'
   
     diff = 0
-    data = callUrl(replicationUrl,timeout,corestatuschecks,core)
+    data = callUrl(coreUrl(baseurl,core,INDEX_VERSION_PATH),timeout,corestatuschecks,core,replicationUrl)
     if(len(data)==0):
         diff = -1
 
     if(data.get('indexversion') != None):
-        ts = datetime.datetime.fromtimestamp(int(data.get('indexversion'))/1000)
-        today = datetime.datetime.today()    
-        diff = diffInSeconds(today,ts)
+        diff = abs(nowms - int(data['indexversion']))//1000
     else:
         recordCheckMsg(core,'index version information not available. Is the node avaialable? '+replicationUrl,corestatuschecks)
         diff = -1
@@ -219,31 +305,130 @@ def indexAgeInSeconds(core,timeout,corestatuschecks):
     return diff
 
 
-def callUrl(url,timeout,corestatuschecks,core):
+def proxyFor(host):
+    """ returns the host:port of the http proxy to connect to for the given host, or None to connect directly
+
+    The proxy is taken from the http_proxy environment variable, unless no_proxy says to bypass it for the host.
+
+    host -- the host:port the request is for
+
+    """
+
+    proxy = urllib.request.getproxies().get('http')
+    if not proxy or urllib.request.proxy_bypass(host):
+        return None
+    return urllib.parse.urlsplit(proxy).netloc.rpartition('@')[2] or proxy
+
+
+def getConnection(url,timeout):
+    """ returns the current thread's keep-alive connection for requesting the given url, creating it if needed,
+    and the request target to send on it
+
+    The connection is to the url's host, or to the http proxy if one is configured for that host.
+
+    url -- the http url to be requested
+    timeout -- the number of seconds max for a request on the connection to take
+
+    """
+
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme != 'http':
+        raise http.client.InvalidURL(f'unsupported url scheme: {url}')
+
+    proxy = proxyFor(parts.netloc)
+    host = proxy or parts.netloc
+
+    connections = getattr(httpConnections,'connections',None)
+    if connections is None:
+        connections = httpConnections.connections = dict()
+
+    conn = connections.get(host)
+    if conn is None:
+        conn = connections[host] = http.client.HTTPConnection(host,timeout=timeout)
+
+    # a proxy is sent the absolute url, the host itself just the path and query string
+    if proxy:
+        return conn, url
+    return conn, urllib.parse.urlunsplit(('','',parts.path or '/',parts.query,''))
+
+
+def sendRequest(conn,target):
+    """ sends a GET for the given target on the connection, returning the response status, Location header and body
+
+    The response is requested gzip compressed, and is decompressed if the server compressed it.
+
+    conn -- the http connection to send the request on
+    target -- the path and query string (or absolute url, for a proxy) to request
+
+    """
+
+    conn.request('GET',target,headers={'Accept-Encoding':'gzip'})
+    res = conn.getresponse()
+    body = res.read()
+    if res.getheader('Content-Encoding') == 'gzip':
+        body = gzip.decompress(body)
+    return res.status, res.getheader('Location'), body
+
+
+def coreUrl(baseurl,core,path):
+    """ returns the url for requesting the given path on a core, with the core name percent-encoded
+
+    baseurl -- the url of the solr server, that the core name is appended to
+    core -- the name of the core
+    path -- the request path, relative to the core
+
+    """
+
+    return f'{baseurl}{urllib.parse.quote(core,safe="")}{path}'
+
+
+def callUrl(url,timeout,corestatuschecks,core,displayUrl=None):
     """ calls the given url, waiting for max timeout
 
+    The connection to the solr host is kept alive and reused for subsequent calls made by the same thread.
+    Redirects to other http urls are followed, up to MAX_REDIRECTS.
+
     url -- The url to call
     timeout -- the number of seconds max for the url request to take
     corestatuschecks -- the dict object to store the status of the url call for the given core
     core -- the core name the url is being executed for
+    displayUrl -- the readable form of the url to report in messages, defaults to the url
 
     """
 
+    if displayUrl is None:
+        displayUrl = url
+
     data = dict()
+    conn = None
     try:
-        with(contextlib.closing(urllib2.urlopen(url,timeout = timeout))) as res:
-            data = json.loads(res.read())
-    except urllib2.URLError, e:
-        if hasattr(e,'reason') and isinstance(e.reason, socket.timeout):
-            # For Python 2.6
-            recordCheckMsg(core,'timeout calling '+url,corestatuschecks)
+        requestUrl = url
+        for redirect in range(MAX_REDIRECTS+1):
+            conn, target = getConnection(requestUrl,timeout)
+            try:
+                status, location, body = sendRequest(conn,target)
+            except http.client.BadStatusLine:
+                # server closed the kept-alive connection, retry once on a new one
+                conn.close()
+                status, location, body = sendRequest(conn,target)
+
+            if status not in REDIRECT_STATUSES or not location:
+                break
+            requestUrl = urllib.parse.urljoin(requestUrl,location)
+
+        if status == http.client.OK:
+            data = jsonLoads(body)
         else:
-            recordCheckMsg(core,'exception calling '+url,corestatuschecks)
-    except socket.timeout, e:
-        # For Python 2.7
-        recordCheckMsg(core,'timeout calling:'+url,corestatuschecks)
-    except socket.error, e:
-        recordCheckMsg(core,'socket error calling:'+url,corestatuschecks)
+            recordCheckMsg(core,f'exception calling {displayUrl}',corestatuschecks)
+    except (http.client.HTTPException, OSError, EOFError, zlib.error, ValueError) as e:
+        # EOFError, zlib.error and ValueError cover a truncated or corrupt gzip body, or a body that is not json.
+        # a failed request can leave the connection part way through a request, so it is never reused
+        if conn is not None:
+            conn.close()
+        if isinstance(e,socket.timeout):
+            recordCheckMsg(core,f'timeout calling {displayUrl}',corestatuschecks)
+        else:
+            recordCheckMsg(core,f'exception calling {displayUrl}',corestatuschecks)
 
     return data
     
@@ -255,7 +440,7 @@ def recordAge(core,age,corestatuschecks):
     corestatuschecks - the dict object to save the age in associated to the core
      
     """
-    corestatuschecks[core]['age'] = age
+    corestatuschecks[core].age = age
     
 
 def recordCheckMsg(core,msg,corestatuschecks):
@@ -267,25 +452,9 @@ def recordCheckMsg(core,msg,corestatuschecks):
     
     """
 
-    corestatuschecks[core]['msg'] = msg
+    corestatuschecks[core].msg = msg
 
     
-def diffInSeconds(date1,date2):
-    """ returns the difference in seconds between the two dates
-    
-    date1 -- date 1 to compare 
-    date2 -- date 2 to compare
-    
-    """
-
-    if(date1>date2) :
-        td = (date1 - date2)
-    else:
-        td = (date2 - date1)
-
-    return (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10**6) / 10**6
-
-
 def indexDiffInSeconds(indexversion1,indexversion2):
     """ compares the milliseconds that the solr indexversion represent against each other
     
@@ -297,9 +466,7 @@ def indexDiffInSeconds(indexversion1,indexversion2):
 
     """
 
-    date1 = datetime.datetime.fromtimestamp(int(indexversion1)/1000)
-    date2 = datetime.datetime.fromtimestamp(int(indexversion2)/1000)
-    return diffInSeconds(date1,date2)
+    return abs(int(indexversion1) - int(indexversion2))//1000
 
 def checkIndexLagAgainstThresholds(lag,warningThreshold,criticalThreshold):
     """ Checks the given lag against the thresholds
@@ -333,10 +500,10 @@ def recordCheckStatus(core,status,statusMap):
 
     if status == 'CRITICAL' or status == 'ERROR':
         statusMap['errors']+=1
-        statusMap[core]['critical']+=1
+        statusMap[core].critical+=1
     elif status == 'WARNING':
         statusMap['errors']+=1
-        statusMap[core]['warning']+=1
+        statusMap[core].warning+=1
 
 
 def checkCommandLineOptions(cmd_options,cmd_parser):
@@ -347,30 +514,45 @@ def checkCommandLineOptions(cmd_options,cmd_parser):
     """
 
     if not cmd_options.plugin_enabled:
-        print "OK: plugin is disabled, doing nothing | { \"status\":\"ok\" }"
-        exit(0)
+        print("OK: plugin is disabled, doing nothing | { \"status\":\"ok\" }")
+        sys.exit(0)
 
-    if not (cmd_options.corenames) :
-        print "Usage: you must specify a core/index (-i)"
+    if not (cmd_options.corenames and cmd_options.corenames.strip(',')) :
+        print("Usage: you must specify a core/index (-i)")
         cmd_parser.print_help()
-        exit(3)
+        sys.exit(3)
 
     if not (cmd_options.solr_server and cmd_options.solr_server_port and cmd_options.solr_server_path):
         cmd_parser.print_help()
-        exit(3)
+        sys.exit(3)
 
     if not cmd_options.check_replication and not cmd_options.check_ping and not cmd_options.check_index_age:
-        print "Usage: Please specify either of the following -R (replication checking), -P (ping check), or -A (index age checking)"
-        exit(3)
+        print("Usage: Please specify either of the following -R (replication checking), -P (ping check), or -A (index age checking)")
+        sys.exit(3)
 
     if not cmd_options.check_ping:
         if ((cmd_options.threshold_warn and not cmd_options.threshold_crit) or (cmd_options.threshold_crit and not cmd_options.threshold_warn)):
-            print "Usage: Please specify the warning and critical values."
-            exit(3)
+            print("Usage: Please specify the warning and critical values.")
+            sys.exit(3)
 
         if cmd_options.threshold_crit <= cmd_options.threshold_warn:
-            print "Usage: the value for (-c|--critical) must be greater than (-w|--warn)"
-            exit(3)
+            print("Usage: the value for (-c|--critical) must be greater than (-w|--warn)")
+            sys.exit(3)
+
+    if cmd_options.master_server and not cmd_options.check_replication:
+        print("Usage: the master (-m|--masterhost) can only be given with the replication check (-R)")
+        sys.exit(3)
+
+    if cmd_options.master_server:
+        try:
+            splitHostPort(cmd_options.master_server)
+        except ValueError:
+            print("Usage: the master (-m|--masterhost) must be given as host or host:port, with a numeric port")
+            sys.exit(3)
+
+    if cmd_options.deadline is not None and cmd_options.deadline <= 0:
+        print("Usage: the value for (-D|--deadline) must be greater than 0")
+        sys.exit(3)
 
 
 def checkStatusOfCores(corestatuschecks,corenames, warningMsg, criticalMsg, okMsg):
@@ -380,18 +562,8 @@ def checkStatusOfCores(corestatuschecks,corenames, warningMsg, criticalMsg, okMs
     
     (
     'errors' : 1,
-    'core1' : (
-               'critical' : 1
-               'warning'  : 0,
-               'msg'      : 'very old'
-               'age'      : 600
-              ),
-    'core2' : (
-               'critical' : 1
-               'warning'  : 0,
-               'msg'      : 'very old'
-               'age'      : 600
-              ),
+    'core1' : CoreStatus(critical=1, warning=0, msg='very old', age=600),
+    'core2' : CoreStatus(critical=1, warning=0, msg='very old', age=600),
     )
     
     The list of given corenames is looped through to create a list of cores that are in warning state, critical state, or ok state.
@@ -405,131 +577,201 @@ def checkStatusOfCores(corestatuschecks,corenames, warningMsg, criticalMsg, okMs
     okMsg -- the ok message to output
     """
 
-    statusmsg=''
-    criticalCores = set()
-    warningCores = set()
-    okCores = set()
-    i = 0
+    details = []
+    criticalCores = []
+    warningCores = []
+    okCores = []
     for core in corenames:
-        if (i > 0):
-            statusmsg+=','
-        if corestatuschecks[core]['warning']>0:
-            warningCores.add(core)
-        elif corestatuschecks[core]['critical']>0:
-            criticalCores.add(core)
+        if corestatuschecks[core].warning>0:
+            warningCores.append(core)
+        elif corestatuschecks[core].critical>0:
+            criticalCores.append(core)
         else:
-            okCores.add(core)
-        statusmsg+="{{\"core\":\"{0}\",\"age(s)\":\"{1}\"".format(core,str(corestatuschecks[core]['age']))
-        if len(corestatuschecks[core]['msg']) >0:
-            statusmsg+=", \"msg\":\"{0}\"".format(corestatuschecks[core]['msg'])
-        statusmsg+='}'
-        i+=1
-
-    criticalCoreString= ""
-    warningCoreString= ""
-    okCoreString= ""
-    
-    if len(criticalCores)>0:
-        criticalCoreString="\""+ "\",\"".join(criticalCores) + "\""
+            okCores.append(core)
+        detail = {'core' : core, 'age(s)' : str(corestatuschecks[core].age)}
+        if len(corestatuschecks[core].msg) >0:
+            detail['msg'] = corestatuschecks[core].msg
+        details.append(detail)
 
-    if len(warningCores)>0:
-        warningCoreString="\""+ "\",\"".join(warningCores) + "\""
+    if corestatuschecks['errors'] > 0:
+        if len(criticalCores)>0:
+            status, msg, exitcode = 'CRITICAL', criticalMsg, 2
+        else:
+            status, msg, exitcode = 'WARNING', warningMsg, 1
+    else:
+        status, msg, exitcode = 'OK', okMsg, 0
 
-    if len(okCores)>0:
-        okCoreString="\""+ "\",\"".join(okCores) + "\""
-    
+    statusdata = {
+        'status' : status,
+        'critical_cores' : criticalCores,
+        'warning_cores' : warningCores,
+        'ok_cores' : okCores,
+        'num_cores_checked' : str(len(corenames)),
+        'num_ok_cores' : str(len(corenames)-corestatuschecks['errors']),
+        'details' : details,
+    }
 
-    statusmsg = " \"critical_cores\": [{0}], \"warning_cores\": [{1}], \"ok_cores\": [{2}],\"num_cores_checked\" : \"{3}\" , \"num_ok_cores\" : \"{4}\", \"details\": [ {5} ] }}".format(criticalCoreString, warningCoreString,okCoreString,len(corenames),len(corenames)-corestatuschecks['errors'],statusmsg)
+    print(f'{msg}| {json.dumps(statusdata)}')
+    sys.exit(exitcode)
 
 
-    if corestatuschecks['errors'] > 0:        
-        if len(criticalCores)>0:
-            print criticalMsg+"| { \"status\": \"CRITICAL\","+statusmsg
-            exit(2)
-        elif len(warningCores)>0:
-            print warningMsg+"| { \"status\": \"WARNING\","+statusmsg
-            exit(1)
-    else:               
-        print okMsg+"| { \"status\": \"OK\","+statusmsg
-        exit(0)
+def prepareCoreStatusDataStructure(corenames):
+    """ returns the dict object for recording the status of the checks, with no errors and a fresh CoreStatus per core
 
+    corenames -- the names of the cores that are to be checked
+
+    """
+
+    corestatuschecks = {core : CoreStatus() for core in corenames}
+    corestatuschecks['errors'] = 0
+    return corestatuschecks
+
+
+CMD_PARSER = OptionParser(version="%prog 1.0.0")
+CMD_PARSER.add_option("-H", "--host", type="string", action="store", dest="solr_server", default="localhost", help="SOLR Server address")
+CMD_PARSER.add_option("-p", "--port", type="string", action="store", dest="solr_server_port", default="8080", help="SOLR Server port")
+CMD_PARSER.add_option("-m", "--masterhost", type="string", action="store", dest="master_server", help="SOLR master server address (host or host:port) for the replication check (-R only) to compare index versions with directly")
+CMD_PARSER.add_option("-u", "--contextpath", type="string", action="store", dest="solr_server_path", help="SOLR Server's context path i.e. solr", default="solr")
+CMD_PARSER.add_option("-P", "--pingcheck", action="store_true", dest="check_ping", help="Monitroing Check: simple url ping that checks the solr instance is running the given cores (indexes)", default=False)
+CMD_PARSER.add_option("-A", "--agecheck", action="store_true", dest="check_index_age", help="Monitoring Check: checking the age of the index given cores is within the given values", default=False)
+CMD_PARSER.add_option("-R", "--replicationcheck", action="store_true", dest="check_replication", help="Monitoring Check: checking the age of the index is within a certain replication time lag", default=False)
+CMD_PARSER.add_option("-w", "--warn", type="int", action="store", dest="threshold_warn", help="WARN threshold for replication check", default=300)
+CMD_PARSER.add_option("-c", "--critical", type="int", action="store", dest="threshold_crit", help="CRIT threshold for replication check", default=600)
+CMD_PARSER.add_option("-i", "--core", type="string", action="store",dest="corenames",help="The comma separated list of solr cores to be checked")
+CMD_PARSER.add_option("-t", "--timeout", type="string", action="store",dest="timeout", help="The timeout for the request to solr", default="30")
+CMD_PARSER.add_option("-D", "--deadline", type="int", action="store",dest="deadline", help="The overall time allowed for checking all the cores, defaults to twice the timeout")
+CMD_PARSER.add_option("-d", "--disabled", action="store_false", dest="plugin_enabled",default=True)
+
+def splitHostPort(hostport):
+    """ splits a host or host:port value into the host and the port (None if not given)
+
+    An IPv6 address must be given in brackets, i.e. [::1]:8080, and is returned in brackets.
+    ValueError is raised if the value is not a valid host or host:port
+
+    hostport -- the host or host:port value to split
+
+    """
+
+    parts = urllib.parse.urlsplit('//' + hostport)
+    port = parts.port
+    if (not parts.hostname or parts.netloc != hostport or parts.username is not None or port == 0
+            or any(c.isspace() for c in hostport)):
+        raise ValueError(f'invalid host or host:port: {hostport}')
+
+    if ':' in parts.hostname:
+        return f'[{parts.hostname}]', port
+    return parts.hostname, port
+
+
+def masterBaseUrl(cmd_options):
+    """ returns the url of the master solr server given with -m, or None if it was not given
+
+    cmd_options -- the options parsed by CMD_PARSER
+
+    """
+
+    if not cmd_options.master_server:
+        return None
+    master_server, master_server_port = splitHostPort(cmd_options.master_server)
+    return f'http://{master_server}:{master_server_port or cmd_options.solr_server_port}/{cmd_options.solr_server_path}/'
+
+
+def bindReplicationCheck(cmd_options):
+    """ returns repstatus, bound to the master given with -m (if any)
+
+    cmd_options -- the options parsed by CMD_PARSER
+
+    """
+
+    return functools.partial(repstatus,masterbaseurl=masterBaseUrl(cmd_options))
 
-def prepareCoreStatusDataStructure(corenames,corestatuschecks):
-    for core in corenames:
-        corestatuschecks['errors']=0
-        corestatuschecks[core] = dict()
-        corestatuschecks[core]['critical']=0
-        corestatuschecks[core]['warning']=0
-        corestatuschecks[core]['msg']=''
-        corestatuschecks[core]['age']=-1
+
+def bindIndexAgeCheck(cmd_options):
+    """ returns indexAgeInSeconds, bound to the current time so every core's index age is measured against
+    the same point in time
+
+    cmd_options -- the options parsed by CMD_PARSER
+
+    """
+
+    return functools.partial(indexAgeInSeconds,nowms=int(time.time()*1000))
+
+
+# a monitoring check: the option enabling it, a function taking the parsed options and returning the function
+# that checks a single core, whether that function's result is a lag to compare against the thresholds, and the
+# messages reporting the check's status
+Check = collections.namedtuple('Check',['option','bind','isLag','warningMsg','criticalMsg','okMsg'])
+
+# the monitoring checks, in order of precedence if more than one is enabled
+CHECKS = (
+    Check(option='check_replication', bind=bindReplicationCheck, isLag=True,
+          warningMsg="WARNING: Index Replication Version Age Check.",
+          criticalMsg="CRITICAL: Index Replication Version Age Check.",
+          okMsg="OK: Index Replication Version Age Check."),
+    Check(option='check_ping', bind=lambda cmd_options: solrping, isLag=False,
+          warningMsg="WARNING: Error pinging cores(s)",
+          criticalMsg="CRITICAL: Error pinging cores(s)",
+          okMsg="OK. Tested core(s) "),
+    Check(option='check_index_age', bind=bindIndexAgeCheck, isLag=True,
+          warningMsg="WARNING: Index Age Check.",
+          criticalMsg="CRITICAL: Index Age Check.",
+          okMsg="OK: Index Age Check."),
+)
 
 
 def main():
-    global baseurl, threshold_warn, threshold_crit, corenames
-    corenames=set()
-
-    cmd_parser = OptionParser(version="%prog 1.0.0")
-    cmd_parser.add_option("-H", "--host", type="string", action="store", dest="solr_server", default="localhost", help="SOLR Server address")
-    cmd_parser.add_option("-p", "--port", type="string", action="store", dest="solr_server_port", default="8080", help="SOLR Server port")
-    cmd_parser.add_option("-u", "--contextpath", type="string", action="store", dest="solr_server_path", help="SOLR Server's context path i.e. solr", default="solr")
-    cmd_parser.add_option("-P", "--pingcheck", action="store_true", dest="check_ping", help="Monitroing Check: simple url ping that checks the solr instance is running the given cores (indexes)", default=False)
-    cmd_parser.add_option("-A", "--agecheck", action="store_true", dest="check_index_age", help="Monitoring Check: checking the age of the index given cores is within the given values", default=False)
-    cmd_parser.add_option("-R", "--replicationcheck", action="store_true", dest="check_replication", help="Monitoring Check: checking the age of the index is within a certain replication time lag", default=False)
-    cmd_parser.add_option("-w", "--warn", type="int", action="store", dest="threshold_warn", help="WARN threshold for replication check", default=300)
-    cmd_parser.add_option("-c", "--critical", type="int", action="store", dest="threshold_crit", help="CRIT threshold for replication check", default=600)
-    cmd_parser.add_option("-i", "--core", type="string", action="store",dest="corenames",help="The comma separated list of solr cores to be checked")
-    cmd_parser.add_option("-t", "--timeout", type="string", action="store",dest="timeout", help="The timeout for the request to solr", default="30")
-    cmd_parser.add_option("-d", "--disabled", action="store_false", dest="plugin_enabled",default=True)
-
-    (cmd_options, cmd_args) = cmd_parser.parse_args()
-    checkCommandLineOptions(cmd_options,cmd_parser)
+    (cmd_options, cmd_args) = CMD_PARSER.parse_args()
+    checkCommandLineOptions(cmd_options,CMD_PARSER)
 
 
     solr_server         = cmd_options.solr_server
     solr_server_port    = cmd_options.solr_server_port
     solr_server_path    = cmd_options.solr_server_path
-    check_ping          = cmd_options.check_ping
-    check_replication   = cmd_options.check_replication
-    check_age           = cmd_options.check_index_age
     threshold_warn      = cmd_options.threshold_warn
     threshold_crit      = cmd_options.threshold_crit
     timeout             = int(cmd_options.timeout)
-    corenames           = list(set(cmd_options.corenames.split(','))) 
+    deadline            = cmd_options.deadline if cmd_options.deadline is not None else timeout*2
+    corenames           = tuple(dict.fromkeys(core for core in cmd_options.corenames.split(',') if core))
 
-    corestatuschecks    = dict()
+    corestatuschecks    = prepareCoreStatusDataStructure(corenames)
 
-    prepareCoreStatusDataStructure(corenames,corestatuschecks)
+    baseurl = f'http://{solr_server}:{solr_server_port}/{solr_server_path}/'
 
-    baseurl = 'http://' + solr_server + ':' + solr_server_port + '/' +  solr_server_path + '/'
 
+    check = next(check for check in CHECKS if getattr(cmd_options,check.option))
+    checkFunction = check.bind(cmd_options)
 
-    for core in corenames:
-        if check_replication:
-            status = checkIndexLagAgainstThresholds(repstatus(core,timeout,corestatuschecks),threshold_warn,threshold_crit)
-            recordCheckStatus(core,status,corestatuschecks)
-        elif check_ping:
-            status = solrping(core,timeout,corestatuschecks)
-            recordCheckStatus(core,status,corestatuschecks)
-        elif check_age:
-            status = checkIndexLagAgainstThresholds(indexAgeInSeconds(core,timeout,corestatuschecks),threshold_warn,threshold_crit)
-            recordCheckStatus(core,status,corestatuschecks)
+    def checkCore(core):
+        result = checkFunction(baseurl,core,timeout,corestatuschecks)
+        if check.isLag:
+            result = checkIndexLagAgainstThresholds(result,threshold_warn,threshold_crit)
+        return core,result
 
-
-    if check_ping:
-        checkStatusOfCores(corestatuschecks,corenames,
-                        "WARNING: Error pinging cores(s)",
-                        "CRITICAL: Error pinging cores(s)",
-                        "OK. Tested core(s) ")
-    elif check_age:
-        checkStatusOfCores(corestatuschecks,corenames,
-                       "WARNING: Index Age Check.",
-                       "CRITICAL: Index Age Check.",
-                       "OK: Index Age Check.")
-    elif check_replication:
-        checkStatusOfCores(corestatuschecks,corenames,
-                       "WARNING: Index Replication Version Age Check.",
-                       "CRITICAL: Index Replication Version Age Check.",
-                       "OK: Index Replication Version Age Check.")
+    # each check is a blocking http call, so run the cores concurrently
+    pool = ThreadPool(min(len(corenames),MAX_WORKERS))
+    pending = set(corenames)
+    reportedchecks = corestatuschecks
+    deadlineTime = time.monotonic() + deadline
+    try:
+        results = pool.imap_unordered(checkCore,corenames)
+        while pending:
+            core,status = results.next(max(deadlineTime - time.monotonic(),0))
+            pending.discard(core)
+            recordCheckStatus(core,status,corestatuschecks)
+    except multiprocessing.TimeoutError:
+        # workers still stuck on a request can go on to record into corestatuschecks, so the status is
+        # reported from a copy in which the pending cores have their own CoreStatus
+        reportedchecks = dict(corestatuschecks)
+        for core in corenames:
+            if core in pending:
+                reportedchecks[core] = CoreStatus()
+                recordCheckMsg(core,'plugin deadline exceeded',reportedchecks)
+                recordCheckStatus(core,'CRITICAL',reportedchecks)
+    finally:
+        # the worker threads are daemons, so any still stuck on a request do not hold up the exit
+        pool.terminate()
+
+    checkStatusOfCores(reportedchecks,corenames,check.warningMsg,check.criticalMsg,check.okMsg)
 
 if __name__ == '__main__':
     main()